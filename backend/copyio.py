@@ -0,0 +1,152 @@
+import codecs
+import io
+import queue
+import struct
+import threading
+
+# ================= COPY FORMAT =================
+
+# COPY ... (FORMAT binary): signature, flags, header extension length
+BINARY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)
+BINARY_TRAILER = struct.pack("!h", -1)
+
+_INT16 = struct.Struct("!h")
+_INT32 = struct.Struct("!i")
+_NULL_FIELD = _INT32.pack(-1)
+
+class FieldTooLarge(ValueError):
+    def __init__(self, index: int):
+        super().__init__(index)
+        self.index = index
+
+def write_binary_row(buf: bytearray, values: list[str], max_field_bytes: int) -> None:
+    # Every column is TEXT: int32 length + UTF-8 bytes, empty cells as NULL.
+    # The size check reuses the encode the framing needs anyway.
+    buf += _INT16.pack(len(values))
+    for i, value in enumerate(values):
+        if value:
+            data = value.encode("utf-8")
+            if len(data) > max_field_bytes:
+                raise FieldTooLarge(i)
+            buf += _INT32.pack(len(data))
+            buf += data
+        else:
+            buf += _NULL_FIELD
+
+# ================= STREAMS =================
+
+class IterReader(io.RawIOBase):
+    """File-like view over an iterator of byte chunks.
+
+    ``copy_expert`` only ever calls ``read(size)``, so rows can be produced
+    lazily while Postgres drains them. psycopg2 swallows exceptions raised
+    from ``read()`` into a generic COPY failure; the original one is kept
+    on ``error`` so callers can re-raise it.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buf = bytearray()  # reused; consumed from the front
+        self.error: Exception | None = None
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        try:
+            while size < 0 or len(self._buf) < size:
+                chunk = next(self._chunks, None)
+                if chunk is None:
+                    break
+                self._buf += chunk
+        except Exception as e:
+            self.error = e
+            raise
+
+        if size < 0 or size > len(self._buf):
+            size = len(self._buf)
+        out = bytes(self._buf[:size])
+        del self._buf[:size]
+        return out
+
+def transcode_chunks(raw, encoding: str, size: int):
+    # Incremental decoder: multi-byte sequences may straddle reads
+    decoder = codecs.getincrementaldecoder(encoding)()
+    while chunk := raw.read(size):
+        yield decoder.decode(chunk).encode("utf-8")
+    yield decoder.decode(b"", final=True).encode("utf-8")
+
+
+class CopyCancelled(Exception):
+    pass
+
+def stream_copy_out(cur, sql: str, on_exit, chunk_size: int = 64 << 10, max_chunks: int = 16):
+    """Yield ``COPY ... TO STDOUT`` output while Postgres is producing it.
+
+    ``copy_expert`` blocks until the COPY is over, so it runs in a worker
+    thread writing into a bounded queue that this generator drains. psycopg2
+    writes one row at a time; rows are coalesced into ``chunk_size`` blocks
+    before crossing the queue.
+
+    ``on_exit(finished)`` runs on the worker thread once it is done with
+    ``cur``, so callers release the connection there. Closing the generator
+    early never waits for the worker; it aborts the COPY and calls
+    ``on_exit(False)``, as the connection is then unusable.
+    """
+    chunks: queue.Queue = queue.Queue(maxsize=max_chunks)
+    done = object()
+    cancelled = threading.Event()
+    errors: list[Exception] = []
+
+    def put(item):
+        while not cancelled.is_set():
+            try:
+                chunks.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                pass
+        raise CopyCancelled()
+
+    pending = bytearray()
+
+    class Writer:
+        def write(self, data):
+            pending.extend(data)
+            if len(pending) >= chunk_size:
+                put(bytes(pending))
+                pending.clear()
+            return len(data)
+
+    def run():
+        finished = False
+        try:
+            cur.copy_expert(sql, Writer())
+            finished = True
+            if pending:
+                put(bytes(pending))
+            put(done)
+        except CopyCancelled:
+            pass
+        except Exception as e:
+            errors.append(e)
+            try:
+                put(done)
+            except CopyCancelled:
+                pass
+        finally:
+            on_exit(finished)
+
+    threading.Thread(target=run, daemon=True).start()
+    try:
+        while (item := chunks.get()) is not done:
+            yield item
+        if errors:
+            raise errors[0]
+    finally:
+        cancelled.set()
+        # Free a worker blocked on a full queue right away
+        try:
+            while True:
+                chunks.get_nowait()
+        except queue.Empty:
+            pass
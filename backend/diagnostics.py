@@ -24,6 +24,9 @@ class DiagnosticError(Exception):
     ):
         self.stage = stage
         self.message = message
+        # CSV record number with the header as 1: blank lines are not
+        # counted and a quoted multi-line value stays one record, which is
+        # how Arrow and PostgreSQL COPY number rows too
         self.row = row
         self.column = column
         self.hint = hint
@@ -1,35 +1,192 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from charset_normalizer import from_bytes
 from diagnostics import DiagnosticError, Stage
+from copyio import (
+    BINARY_HEADER,
+    BINARY_TRAILER,
+    FieldTooLarge,
+    IterReader,
+    stream_copy_out,
+    transcode_chunks,
+    write_binary_row,
+)
 import psycopg2
+import psycopg2.extensions
+from psycopg2.pool import ThreadedConnectionPool
+import asyncio
 import os
+import io
 import csv
 import re
-from io import StringIO
+import codecs
+import operator
+import zlib
+import threading
+import time
+import logging
+from contextlib import asynccontextmanager, contextmanager
 from datetime import datetime
 
+try:
+    import cchardet  # optional, far faster than charset_normalizer
+except ImportError:
+    cchardet = None
+
+try:
+    import pyarrow as pa  # multithreaded C++ CSV parsing; csv.reader without it
+    import pyarrow.compute as pc
+    import pyarrow.csv as pacsv
+except ImportError:
+    pacsv = None
+
 # ================= CONFIG =================
 
+logger = logging.getLogger("uvicorn.error")
+
 DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise RuntimeError("DATABASE_URL not set")
 
-app = FastAPI()
+# Behind a PgBouncer on the private network, set both of these:
+#   DATABASE_SSLMODE=disable   the bouncer terminates TLS
+#   DATABASE_PREPARE=off       in transaction pooling mode
+# /search PREPAREs its queries per connection (execute_prepared). A
+# transaction-mode bouncer hands each autocommit statement whichever server
+# connection is free, so EXECUTE can land where the PREPARE never ran.
+DATABASE_SSLMODE = os.getenv("DATABASE_SSLMODE", "require")
+DATABASE_PREPARE = os.getenv("DATABASE_PREPARE", "on") != "off"
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Open the pool's warm connections before the first request, off the
+    # event loop. A database that is down at boot doesn't stop the app:
+    # the first request that needs a connection retries.
+    try:
+        await run_in_threadpool(get_pool)
+    except psycopg2.OperationalError as e:
+        logger.warning("Database unavailable at startup: %s", e)
+    yield
+    close_pool()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    max_age=86400,  # cache preflights; browsers clamp this to their own limit
 )
+# JSON responses; /download compresses its own stream and is left alone
+app.add_middleware(GZipMiddleware, minimum_size=1024)
 
 # ================= DB =================
 
-def get_db():
-    return psycopg2.connect(DATABASE_URL, sslmode="require")
+class Connection(psycopg2.extensions.connection):
+    """Pooled connection that remembers the statements it has PREPAREd."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared: dict[tuple, str] = {}
+
+# One TLS handshake per pooled connection instead of per request.
+# psycopg2 closes returned connections beyond minconn, so minconn (opened
+# up front) is also how many stay warm between bursts.
+POOL_MINCONN = 8
+POOL_MAXCONN = 16
+
+_pool: ThreadedConnectionPool | None = None
+_pool_lock = threading.Lock()
+
+# getconn() raises PoolError once maxconn are checked out instead of
+# waiting; this makes callers queue for a free connection, for at most
+# POOL_TIMEOUT seconds before answering 503
+POOL_TIMEOUT = 5.0
+_pool_slots = threading.BoundedSemaphore(POOL_MAXCONN)
+
+def get_pool() -> ThreadedConnectionPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadedConnectionPool(
+                minconn=POOL_MINCONN,
+                maxconn=POOL_MAXCONN,
+                dsn=DATABASE_URL,
+                sslmode=DATABASE_SSLMODE,
+                # Set at connect time: psycopg2's set_client_encoding() on a
+                # connection in a transaction aborts it (and any SET LOCAL).
+                # COPY chunks are UTF-8, binary TEXT fields included.
+                client_encoding="UTF8",
+                connection_factory=Connection,
+            )
+        return _pool
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+
+def get_db(autocommit: bool = False):
+    if not _pool_slots.acquire(timeout=POOL_TIMEOUT):
+        raise HTTPException(
+            status_code=503,
+            detail="Database busy, try again shortly",
+            headers={"Retry-After": "5"},
+        )
+    try:
+        conn = get_pool().getconn()
+    except BaseException:
+        _pool_slots.release()
+        raise
+    # Reads skip the extra BEGIN round-trip psycopg2 sends otherwise
+    conn.autocommit = autocommit
+    return conn
+
+def put_db(conn, close: bool = False):
+    try:
+        if _pool is None:
+            conn.close()  # pool already shut down
+        else:
+            _pool.putconn(conn, close=close)
+    finally:
+        _pool_slots.release()
+
+@contextmanager
+def db(autocommit: bool = False):
+    conn = get_db(autocommit)
+    try:
+        yield conn
+    finally:
+        put_db(conn)
+
+MAX_PREPARED = 64
+
+def execute_prepared(cur, key: tuple, sql: str, params: tuple):
+    # Parse + plan once per pooled connection, EXECUTE on every later hit.
+    # Dropped datasets leave stale statements behind, hence the cap.
+    # ``sql`` takes %s placeholders, as cur.execute() does.
+    if not DATABASE_PREPARE:
+        cur.execute(sql, params)
+        return
+
+    prepared = cur.connection.prepared
+    name = prepared.get(key)
+    if name is None:
+        if len(prepared) >= MAX_PREPARED:
+            cur.execute("DEALLOCATE ALL")
+            prepared.clear()
+        name = f"stmt_{len(prepared)}"
+        numbered = sql % tuple(f"${i}" for i in range(1, len(params) + 1))
+        cur.execute(f"PREPARE {name} AS {numbered}")
+        prepared[key] = name
+    cur.execute(f"EXECUTE {name} ({','.join(['%s'] * len(params))})", params)
 
 # ================= SCHEMA =================
 
@@ -50,69 +207,337 @@ SCHOOL_COLUMNS = [
     "highest_class",
 ]
 
+# Checked in order: first schema whose columns are all present wins
+SCHEMAS = {
+    "teacher": TEACHER_COLUMNS,
+    "school": SCHOOL_COLUMNS,
+}
+
+# Exact header sets (any order) resolve with one dict lookup
+_SCHEMA_BY_HEADERS = {frozenset(cols): name for name, cols in SCHEMAS.items()}
+
+# Columns /search filters on, indexed after each upload
+INDEX_COLUMNS = {
+    "teacher": ["school_code", "employee_code"],
+    "school": ["school_code"],
+}
+
 # ================= UTILS =================
 
+_NON_IDENT_RE = re.compile(r"[^a-z0-9_]+")
+
 def normalize(col: str) -> str:
     col = col.replace("\ufeff", "")
     col = col.strip()
-    return re.sub(r"[^a-z0-9_]+", "_", col.lower())
+    return _NON_IDENT_RE.sub("_", col.lower())
 
 def detect_schema(headers: list[str]) -> str:
-    header_set = set(headers)
+    header_set = frozenset(headers)
+
+    schema = _SCHEMA_BY_HEADERS.get(header_set)
+    if schema:
+        return schema
 
-    if set(TEACHER_COLUMNS).issubset(header_set):
-        return "teacher"
-    if set(SCHOOL_COLUMNS).issubset(header_set):
-        return "school"
+    # Extra columns: fall back to subset checks
+    for name, cols in SCHEMAS.items():
+        if header_set.issuperset(cols):
+            return name
 
     raise DiagnosticError(stage=Stage.SCHEMA,message="Unrecognized CSV schema",hint=f"Headers received: {headers}",)
 
 
 def build_table_name(schema: str, filename: str) -> str:
-    name = re.sub(r"[^a-z0-9_]+", "_", filename.lower().replace(".csv", ""))
+    name = _NON_IDENT_RE.sub("_", filename.lower().removesuffix(".csv"))
     ts = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
     return f"{schema}_{name}_{ts}"
 
-def decode_csv_bytes(raw: bytes) -> str:
-    # 1️⃣ UTF-16 (Excel favorite)
-    try:
-        return raw.decode("utf-16")
-    except UnicodeDecodeError:
-        pass
+def create_table(cur, table: str, cols: list[str]):
+    cur.execute(f'''
+        CREATE TABLE "{table}" (
+            id BIGSERIAL PRIMARY KEY,
+            {", ".join(f"{c} TEXT" for c in cols)}
+        )
+    ''')
+
+def build_copy_sql(table: str, cols: list[str], options: str) -> str:
+    # FREEZE: rows land already frozen and all-visible, so the first VACUUM
+    # doesn't rewrite every page. Needs the table created in the same
+    # (sub)transaction as the COPY.
+    return f'COPY "{table}" ({",".join(cols)}) FROM STDIN WITH ({options}, FREEZE)'
+
+# CONTEXT of a COPY error: "COPY t, line 42, column school_name: ..."
+_COPY_CONTEXT_RE = re.compile(r"line (\d+)(?:, column (\w+))?")
+
+def copy_error(e: psycopg2.Error) -> DiagnosticError:
+    match = _COPY_CONTEXT_RE.search(e.diag.context or "")
+    return DiagnosticError(
+        stage=Stage.COPY,
+        message="PostgreSQL COPY failed",
+        row=int(match.group(1)) + 1 if match else None,  # COPY counts records; +1 for the header
+        column=match.group(2) if match else None,
+        hint=e.diag.message_primary or str(e),
+    )
+
+SNIFF_BYTES = 65_536  # prefix used to pick the file encoding
 
-    # 2️⃣ UTF-8 with BOM
+# Only charsets we actually receive; skips ~90 others in detection
+CANDIDATE_ENCODINGS = [
+    "utf_8",
+    "cp1252",
+    "latin_1",
+    "utf_16",
+    "utf_16_le",
+    "utf_16_be",
+]
+
+def detect_encoding(prefix: bytes) -> str:
+    # 1️⃣ UTF-16 (Excel favorite) — only with a BOM, a BOM-less ASCII
+    # prefix "decodes" as UTF-16 garbage
+    if prefix.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return "utf-16"
+
+    # 2️⃣ UTF-8 with or without BOM (prefix may end mid-character)
     try:
-        return raw.decode("utf-8-sig")
+        codecs.getincrementaldecoder("utf-8-sig")().decode(prefix, final=False)
+        return "utf-8-sig"
     except UnicodeDecodeError:
         pass
 
     # 3️⃣ Charset auto-detection (Latin-1, Windows-1252)
-    result = from_bytes(raw).best()
+    if cchardet is not None:
+        guess = cchardet.detect(prefix).get("encoding")
+        try:
+            return codecs.lookup(guess).name
+        except (TypeError, LookupError):
+            pass
+
+    result = from_bytes(prefix, cp_isolation=CANDIDATE_ENCODINGS).best()
     if result:
-        return str(result)
+        return result.encoding
 
     raise DiagnosticError(stage=Stage.ENCODING, message="Unable to decode CSV file",hint="Use UTF-8, UTF-16, or Windows-1252 encoding",)
 
+def read_header(prefix: bytes, encoding: str) -> list[str] | None:
+    text = codecs.getincrementaldecoder(encoding)(errors="replace").decode(prefix)
+    return next(csv.reader(io.StringIO(text, newline="")), None)
+
 
 MAX_FIELD_BYTES = 100_000  # safely below Postgres COPY limit (131072)
 
-def safe_cell(value: str, row: int, column: str) -> str:
-    if not value:
-        return ""
+# ================= COPY STREAMS =================
+
+# Exactly what str.strip() and pc.utf8_trim_whitespace() remove, Unicode
+# spaces such as U+00A0 included (none lie above U+3000)
+_WHITESPACE = "E'%s'" % "".join(
+    f"\\u{i:04x}" for i in range(0x3001) if chr(i).isspace()
+)
 
-    data = value.encode("utf-8", errors="ignore")
-    if len(data) > MAX_FIELD_BYTES:
+# copy_expert reads its source 8 KiB at a time by default: one Python
+# read() and one PQputCopyData per 8 KiB
+COPY_READ_SIZE = 1 << 20
+
+# A quoted empty cell: COPY keeps it as '' where the parsers store NULL
+_QUOTED_EMPTY_RE = re.compile(r'(?:^|,)""(?=,|\r?$)', re.MULTILINE)
+
+def needs_cleaning(prefix: bytes, encoding: str) -> bool:
+    # Would any cell in the sniffed prefix change under the parsing paths'
+    # rules? Such files skip the passthrough rather than being fixed up in
+    # SQL after COPY.
+    text = codecs.getincrementaldecoder(encoding)(errors="replace").decode(prefix)
+    if len(prefix) == SNIFF_BYTES:
+        text = text[: text.rfind("\n") + 1]  # drop the cut-off last line
+    if _QUOTED_EMPTY_RE.search(text):
+        return True
+    reader = csv.reader(io.StringIO(text, newline=""))
+    next(reader, None)  # header
+    return any(v != v.strip() for row in reader for v in row)
+
+def copy_passthrough(cur, raw, table: str, table_cols: list[str], cols: list[str], encoding: str) -> int | None:
+    """Create ``table`` and COPY the uploaded bytes into it unchanged.
+
+    ``cols`` is the file's header, a permutation of ``table_cols``. Files
+    not already in UTF-8 are re-encoded on the way, here rather than by the
+    server's COPY ENCODING conversion. Only for files whose cells already
+    meet the parsing paths' rules (trimmed, no quoted empties, size limit):
+    the caller checks the sniffed prefix with needs_cleaning(), and a cell
+    past it that breaks a rule is found by one read-only scan afterwards.
+    Rewriting such rows in SQL would double the heap and WAL, leave dead
+    tuples and undo FREEZE, so the load is abandoned instead.
+
+    Returns None, rolled back to before the table existed, if Postgres
+    rejects the file or a cell needs cleaning; the caller then falls back
+    to a parsing path, which also gives row-level diagnostics.
+    """
+    raw.seek(0)
+    cur.execute("SAVEPOINT passthrough")
+    create_table(cur, table, table_cols)  # inside the savepoint, for FREEZE
+    if codecs.lookup(encoding).name not in ("utf-8", "utf-8-sig"):
+        raw = IterReader(transcode_chunks(raw, encoding, COPY_READ_SIZE))
+    try:
+        cur.copy_expert(
+            build_copy_sql(table, cols, "FORMAT csv, HEADER"),
+            raw,
+            size=COPY_READ_SIZE,
+        )
+    except psycopg2.Error:
+        cur.execute("ROLLBACK TO SAVEPOINT passthrough")
+        return None
+    rows = cur.rowcount
+
+    needs_trim = " OR ".join(
+        f"{c} = '' OR {c} <> btrim({c}, {_WHITESPACE})" for c in cols
+    )
+    too_long = " ".join(
+        f"WHEN octet_length({c}) > {MAX_FIELD_BYTES} THEN '{c}'" for c in cols
+    )
+    cur.execute(f'''
+        SELECT id, CASE {too_long} END AS col FROM "{table}"
+        WHERE {needs_trim} OR CASE {too_long} END IS NOT NULL
+        ORDER BY id
+        LIMIT 1
+    ''')
+    first_bad = cur.fetchone()
+    if first_bad and first_bad[1]:
         raise DiagnosticError(
             stage=Stage.ROW,
             message="Field exceeds PostgreSQL COPY size limit",
-            row=row,
-            column=column,
+            row=first_bad[0] + 1,  # ids follow file order; +1 for the header
+            column=first_bad[1],
             hint="Very large text detected (possibly corrupted data)",
         )
-    return value
+    if first_bad:
+        cur.execute("ROLLBACK TO SAVEPOINT passthrough")
+        return None
+    return rows
+
+BATCH_SIZE = 50_000
+BATCH_BYTES = 8 << 20  # caps memory when rows are wide
+
+def python_copy_chunks(reader, encoding: str, headers: list[str], copy_cols: list[str]):
+    # Pick the COPY columns out of each raw row in one C call
+    pick = operator.itemgetter(*[headers.index(c) for c in copy_cols])
+    width = len(headers)
+
+    chunk = bytearray(BINARY_HEADER)
+    chunk_rows = 0
+    row_num = 1  # header; see DiagnosticError.row
+    try:
+        for row in reader:
+            if not row:
+                continue  # blank line, not a record
+            row_num += 1
+            if len(row) != width:
+                raise DiagnosticError(
+                    stage=Stage.ROW,
+                    message="Column count does not match header",
+                    row=row_num,
+                    hint=f"Expected {width} fields, got {len(row)}",
+                )
 
+            try:
+                write_binary_row(chunk, [v.strip() for v in pick(row)], MAX_FIELD_BYTES)
+            except FieldTooLarge as e:
+                raise DiagnosticError(
+                    stage=Stage.ROW,
+                    message="Field exceeds PostgreSQL COPY size limit",
+                    row=row_num,
+                    column=copy_cols[e.index],
+                    hint="Very large text detected (possibly corrupted data)",
+                )
+            chunk_rows += 1
 
+            if chunk_rows >= BATCH_SIZE or len(chunk) >= BATCH_BYTES:
+                yield chunk  # IterReader copies it before we resume
+                chunk.clear()
+                chunk_rows = 0
 
+        # Flush remaining rows
+        chunk += BINARY_TRAILER
+        yield chunk
+    except UnicodeDecodeError:
+        # No row: TextIOWrapper decodes ahead of the rows csv.reader has
+        # returned, so row_num can be several rows short of the bad bytes
+        raise DiagnosticError(
+            stage=Stage.ENCODING,
+            message="CSV file is not consistently encoded",
+            hint=f"Detected {encoding} from the start of the file",
+        )
+
+# Arrow errors name the file row: "In CSV column #0: Row #42: ..."
+_ARROW_ROW_RE = re.compile(r"Row #(\d+)")
+
+def arrow_copy_chunks(raw, encoding: str, headers: list[str], copy_cols: list[str]):
+    # Same rules as python_copy_chunks, applied per record batch; emits CSV
+    null = pa.scalar(None, pa.string())
+    write_options = pacsv.WriteOptions(include_header=False)
+    first_row = 2
+    # Arrow reads UTF-8 natively and skips a BOM itself; any other name
+    # sends every block through Python's codec machinery first
+    if codecs.lookup(encoding).name in ("utf-8", "utf-8-sig"):
+        encoding = "utf8"
+    try:
+        batches = pacsv.open_csv(
+            raw,
+            read_options=pacsv.ReadOptions(
+                encoding=encoding,
+                column_names=headers,
+                skip_rows=1,
+                block_size=BATCH_BYTES,
+            ),
+            parse_options=pacsv.ParseOptions(newlines_in_values=True),
+            convert_options=pacsv.ConvertOptions(
+                include_columns=copy_cols,
+                column_types={c: pa.string() for c in copy_cols},
+                strings_can_be_null=False,
+            ),
+        )
+        for batch in batches:
+            columns = []
+            for c in copy_cols:
+                values = pc.utf8_trim_whitespace(batch.column(c))
+                too_long = pc.greater(pc.binary_length(values), MAX_FIELD_BYTES)
+                if pc.any(too_long).as_py():
+                    raise DiagnosticError(
+                        stage=Stage.ROW,
+                        message="Field exceeds PostgreSQL COPY size limit",
+                        row=first_row + pc.index(too_long, True).as_py(),
+                        column=c,
+                        hint="Very large text detected (possibly corrupted data)",
+                    )
+                columns.append(pc.if_else(pc.equal(values, ""), null, values))
+
+            sink = io.BytesIO()
+            pacsv.write_csv(
+                pa.RecordBatch.from_arrays(columns, names=copy_cols),
+                sink,
+                write_options,
+            )
+            yield sink.getvalue()
+            first_row += batch.num_rows  # records; Arrow drops blank lines
+    except UnicodeDecodeError:
+        # Raised by the Python transcoder for non-UTF-8 input; no row known
+        raise DiagnosticError(
+            stage=Stage.ENCODING,
+            message="CSV file is not consistently encoded",
+            hint=f"Detected {encoding} from the start of the file",
+        )
+    except pa.ArrowInvalid as e:
+        message = str(e).split("\n")[0]
+        match = _ARROW_ROW_RE.search(message)
+        row = int(match.group(1)) if match else None
+        if "invalid UTF8" in message:
+            raise DiagnosticError(
+                stage=Stage.ENCODING,
+                message="CSV file is not consistently encoded",
+                row=row,
+                hint="Detected utf-8 from the start of the file",
+            )
+        raise DiagnosticError(
+            stage=Stage.ROW,
+            message="Malformed CSV data",
+            row=row,
+            hint=message,
+        )
 
 # ================= HEALTH =================
 
@@ -122,119 +547,94 @@ def health():
 
 # ================= UPLOAD =================
 
+# Each load holds a pooled connection and saturates a core while parsing;
+# extra uploads wait here instead of exhausting the pool
+MAX_CONCURRENT_UPLOADS = 4
+UPLOAD_SLOTS = asyncio.Semaphore(MAX_CONCURRENT_UPLOADS)
+
 @app.post("/upload-csv")
 async def upload_csv(file: UploadFile = File(...)):
     if not file.filename.lower().endswith(".csv"):
         raise HTTPException(status_code=400, detail="Only CSV allowed")
 
+    # Queued uploads wait on the event loop without tying up a threadpool
+    # worker; only running ones take a thread for the blocking parse + COPY
+    async with UPLOAD_SLOTS:
+        result = await run_in_threadpool(load_csv, file)
+    invalidate_datasets()  # connection is back in the pool by now
+    return result
+
+def load_csv(file: UploadFile) -> dict:
     conn = get_db()
     cur = conn.cursor()
 
     try:
-        # Read & decode ONCE
-        raw = await file.read()
-        text = decode_csv_bytes(raw)
-        stream = StringIO(text)
-
-        reader = csv.DictReader(stream)
-        if not reader.fieldnames:
+        # Bulk-load settings, reset at COMMIT: don't wait for the WAL flush,
+        # and give the post-COPY index builds memory and parallel workers
+        cur.execute("""
+            SET LOCAL synchronous_commit = off;
+            SET LOCAL maintenance_work_mem = '512MB';
+            SET LOCAL max_parallel_maintenance_workers = 4
+        """)
+
+        # Sniff the encoding and header from a prefix, then stream the rest
+        prefix = file.file.read(SNIFF_BYTES)
+        encoding = detect_encoding(prefix)
+        raw_headers = read_header(prefix, encoding)
+        if not raw_headers:
             raise HTTPException(status_code=400, detail="Empty CSV")
 
-        headers = [normalize(h) for h in reader.fieldnames]
-        reader.fieldnames = headers
+        headers = [normalize(h) for h in raw_headers]
 
         schema = detect_schema(headers)
         table = build_table_name(schema, file.filename)
 
-        if schema == "teacher":
-            copy_cols = TEACHER_COLUMNS
-            cur.execute(f'''
-                CREATE TABLE "{table}" (
-                    id BIGSERIAL PRIMARY KEY,
-                    school_code TEXT,
-                    school_name TEXT,
-                    employee_name TEXT,
-                    employee_code TEXT,
-                    designation TEXT
-                )
-            ''')
-        else:
-            copy_cols = SCHOOL_COLUMNS
-            cur.execute(f'''
-                CREATE TABLE "{table}" (
-                    id BIGSERIAL PRIMARY KEY,
-                    school_code TEXT,
-                    school_name TEXT,
-                    block_name TEXT,
-                    district_name TEXT,
-                    lowest_class TEXT,
-                    highest_class TEXT
-                )
-            ''')
-
-        # --- CHUNKED COPY ---
-        buffer = StringIO()
-        writer = csv.writer(buffer)
-        writer.writerow(copy_cols)  # header
-
-        BATCH_SIZE = 5000
-        row_count = 0
-        total_rows = 0
-
-        for row_num, row in enumerate(reader, start=2):
-            writer.writerow([
-                safe_cell((row.get(c) or "").strip(), row_num, c)
-                for c in copy_cols
-            ])
-        
-            row_count += 1
-            total_rows += 1
-        
-            if row_count >= BATCH_SIZE:
-                buffer.seek(0)
-                try:
-                    cur.copy_expert(
-                        f'''
-                        COPY "{table}" ({",".join(copy_cols)})
-                        FROM STDIN WITH CSV
-                        ''',
-                        buffer
-                    )
-                except psycopg2.Error as e:
-                    raise DiagnosticError(
-                        stage=Stage.COPY,
-                        message="PostgreSQL COPY failed",
-                        hint=e.pgerror.split("\n")[0] if e.pgerror else str(e),
-                    )
-            
-                buffer = StringIO()
-                writer = csv.writer(buffer)
-                row_count = 0
-
-
-        # Flush remaining rows
-        if row_count > 0:
-            buffer.seek(0)
+        copy_cols = SCHEMAS[schema]
+
+        # --- PASSTHROUGH COPY ---
+        # Header has exactly the table's columns, in any order: Postgres
+        # parses the raw bytes, with the COPY column list in file order
+        rows = None
+        same_cols = len(headers) == len(copy_cols) and set(headers) == set(copy_cols)
+        if same_cols and not needs_cleaning(prefix, encoding):
+            rows = copy_passthrough(cur, file.file, table, copy_cols, headers, encoding)
+
+        # --- STREAMING COPY ---
+        # Rows flow upload -> parse -> COPY without materializing the file
+        if rows is None:
+            create_table(cur, table, copy_cols)
+            file.file.seek(0)
+            if pacsv is not None:
+                chunks = arrow_copy_chunks(file.file, encoding, headers, copy_cols)
+                copy_format = "csv"
+            else:
+                reader = csv.reader(io.TextIOWrapper(file.file, encoding=encoding, newline=""))
+                next(reader, None)  # header
+                chunks = python_copy_chunks(reader, encoding, headers, copy_cols)
+                copy_format = "binary"
+
+            copy_sql = build_copy_sql(table, copy_cols, f"FORMAT {copy_format}")
+            source = IterReader(chunks)
             try:
-                cur.copy_expert(
-                    f'''
-                    COPY "{table}" ({",".join(copy_cols)})
-                    FROM STDIN WITH CSV
-                    ''',
-                    buffer
-                )
+                cur.copy_expert(copy_sql, source, size=COPY_READ_SIZE)
             except psycopg2.Error as e:
-                raise DiagnosticError(
-                    stage=Stage.COPY,
-                    message="PostgreSQL COPY failed",
-                    hint=e.pgerror.split("\n")[0] if e.pgerror else str(e),
-                )
-
-
-        cur.execute(f'SELECT COUNT(*) FROM "{table}"')
-        rows = cur.fetchone()[0]
-
-        cur.execute("""
+                if source.error:
+                    raise source.error
+                raise copy_error(e)
+
+            # COPY's command tag already carries the row count
+            rows = cur.rowcount
+
+        # Index after COPY: one bulk sort instead of per-row B-tree inserts.
+        # ANALYZE so the first searches are planned from real statistics.
+        # Sent together with the registry row as one round-trip.
+        index_sql = "".join(
+            f'CREATE INDEX ON "{table}" ({col});'
+            for col in INDEX_COLUMNS[schema]
+        )
+        cur.execute(f"""
+            {index_sql}
+            ANALYZE "{table}";
             INSERT INTO dataset_registry (table_name, dataset_type, row_count)
             VALUES (%s, %s, %s)
         """, (table, schema, rows))
@@ -264,27 +664,53 @@ async def upload_csv(file: UploadFile = File(...)):
 
     finally:
         cur.close()
-        conn.close()
+        put_db(conn)
 
 
 # ================= DATASETS =================
 
-@app.get("/datasets")
-def list_datasets():
-    conn = get_db()
-    cur = conn.cursor()
-
-    cur.execute("""
-        SELECT table_name, dataset_type, row_count, uploaded_at
-        FROM dataset_registry
-        ORDER BY uploaded_at DESC
-    """)
+# Polling UIs hit /datasets constantly; serve them from memory. Uploads and
+# deletes drop the cached list, so the TTL only bounds staleness for changes
+# made through other worker processes.
+DATASETS_TTL = 60.0
+_datasets_cache: tuple[float, list[dict]] | None = None
+# Bumped on every change; a listing that raced one isn't cached
+_datasets_generation = 0
+# Guards the two above only, never held across a pool checkout or query
+_datasets_lock = threading.Lock()
+
+def invalidate_datasets():
+    # Call after the connection is back in the pool
+    global _datasets_cache, _datasets_generation
+    with _datasets_lock:
+        _datasets_generation += 1
+        _datasets_cache = None
+
+class Dataset(BaseModel):
+    table: str
+    type: str
+    rows: int | None
+    uploaded_at: datetime
 
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
+# Declared return type: FastAPI serializes straight to JSON bytes in
+# pydantic-core instead of jsonable_encoder + json.dumps
+@app.get("/datasets")
+def list_datasets() -> list[Dataset]:
+    global _datasets_cache
+    with _datasets_lock:
+        if _datasets_cache and _datasets_cache[0] > time.monotonic():
+            return _datasets_cache[1]
+        generation = _datasets_generation
+
+    with db(autocommit=True) as conn, conn.cursor() as cur:
+        cur.execute("""
+            SELECT table_name, dataset_type, row_count, uploaded_at
+            FROM dataset_registry
+            ORDER BY uploaded_at DESC
+        """)
+        rows = cur.fetchall()
 
-    return [
+    datasets = [
         {
             "table": r[0],
             "type": r[1],
@@ -293,6 +719,11 @@ def list_datasets():
         }
         for r in rows
     ]
+    with _datasets_lock:
+        # An upload or delete since the query started may be missing
+        if generation == _datasets_generation:
+            _datasets_cache = (time.monotonic() + DATASETS_TTL, datasets)
+    return datasets
 
 # ================= DELETE =================
 
@@ -304,59 +735,121 @@ def delete_dataset(payload: DeletePayload):
     if not payload.table.isidentifier():
         raise HTTPException(status_code=400, detail="Invalid table")
 
-    conn = get_db()
-    cur = conn.cursor()
-
-    try:
-        cur.execute("DELETE FROM dataset_registry WHERE table_name = %s", (payload.table,))
-
-        if cur.rowcount == 0:
+    with db() as conn, conn.cursor() as cur:
+        # Registry first: only a registered dataset's table is ever dropped
+        # (or ACCESS EXCLUSIVE locked)
+        cur.execute(
+            "DELETE FROM dataset_registry WHERE table_name = %s RETURNING table_name",
+            (payload.table,),
+        )
+        if cur.fetchone() is None:
+            conn.rollback()
             raise DiagnosticError(
                 stage=Stage.DELETE,
                 message="Delete failed: dataset not found",
                 hint=f"table={payload.table}",
             )
-        
+
         cur.execute(f'DROP TABLE IF EXISTS "{payload.table}"')
         conn.commit()
-        return {"status": "deleted"}
-    finally:
-        cur.close()
-        conn.close()
+
+    invalidate_datasets()
+    return {"status": "deleted"}
 
 # ================= DOWNLOAD =================
 
+# A download holds its connection for as long as the client reads, so
+# slow clients are capped well below POOL_MAXCONN to leave room for
+# uploads and searches
+MAX_CONCURRENT_DOWNLOADS = 6
+_download_slots = threading.BoundedSemaphore(MAX_CONCURRENT_DOWNLOADS)
+
+class DownloadBody:
+    """Iterates ``chunks`` and frees a download slot exactly once.
+
+    The slot is taken before the response starts, so it is also freed
+    when the body is never iterated (client gone before the first send)
+    or is dropped half-way without close().
+    """
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self._held = True
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._chunks)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        if self._held:
+            self._held = False
+            try:
+                self._chunks.close()
+            finally:
+                _download_slots.release()
+
+    __del__ = close
+
+def gzip_chunks(chunks):
+    # wbits=31 -> gzip container; zlib buffers small COPY rows for us
+    z = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = z.compress(chunk)
+        if data:
+            yield data
+    yield z.flush()
+
 @app.get("/download/{table}")
-def download(table: str):
+def download(table: str, request: Request):
     if not table.isidentifier():
         raise HTTPException(status_code=400, detail="Invalid table")
-
-    conn = get_db()
-    cur = conn.cursor()
+    # Refuse up front: once streaming starts the status is already 200
+    if not _download_slots.acquire(blocking=False):
+        raise HTTPException(
+            status_code=503,
+            detail="Too many downloads in progress, try again shortly",
+            headers={"Retry-After": "5"},
+        )
 
     def stream():
-        buf = StringIO()
-        try:
-            cur.copy_expert(f'COPY "{table}" TO STDOUT WITH CSV HEADER', buf)
-            buf.seek(0)
-            while True:
-                chunk = buf.read(8192)
-                if not chunk:
-                    break
-                yield chunk
-        finally:
-            buf.close()
+        # Checked out on first iteration: a response that never starts
+        # streaming never holds a connection
+        conn = get_db()
+        cur = conn.cursor()
+
+        def release(finished: bool):
             cur.close()
-            conn.close()
+            # An abandoned COPY leaves the connection mid-protocol
+            put_db(conn, close=not finished)
 
-    return StreamingResponse(
-        stream(),
-        media_type="text/csv",
-        headers={"Content-Disposition": f'attachment; filename="{table}.csv"'}
-    )
+        yield from stream_copy_out(
+            cur, f'COPY "{table}" TO STDOUT WITH CSV HEADER', release
+        )
+
+    body = DownloadBody(stream())
+    headers = {
+        "Content-Disposition": f'attachment; filename="{table}.csv"',
+        "Vary": "Accept-Encoding",
+        # Keep nginx-style reverse proxies from buffering the whole stream
+        "X-Accel-Buffering": "no",
+    }
+    # CSV compresses 5-10x; browsers decode it transparently
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        body = gzip_chunks(body)
+        headers["Content-Encoding"] = "gzip"
+
+    return StreamingResponse(body, media_type="text/csv", headers=headers)
 
 # ================= SEARCH =================
 
+SEARCH_LIMIT = 1000
+
 @app.get("/search")
 def search(table: str, field: str, value: str):
     if not table.isidentifier():
@@ -364,13 +857,12 @@ def search(table: str, field: str, value: str):
     if field not in {"school_code", "employee_code"}:
         raise HTTPException(status_code=400, detail="Invalid field")
 
-    conn = get_db()
-    cur = conn.cursor()
-
-    try:
-        cur.execute(
-            f'SELECT * FROM "{table}" WHERE "{field}"=%s',
-            (value.strip(),)
+    with db(autocommit=True) as conn, conn.cursor() as cur:
+        execute_prepared(
+            cur,
+            ("search", table, field),
+            f'SELECT * FROM "{table}" WHERE "{field}"=%s LIMIT {SEARCH_LIMIT}',
+            (value.strip(),),
         )
         rows = cur.fetchall()
         if not rows:
@@ -380,8 +872,5 @@ def search(table: str, field: str, value: str):
                 hint=f"{field} = {value}",
             )
 
-        cols = [d[0] for d in cur.description]
-        return {"rows": [dict(zip(cols, r)) for r in rows]}
-    finally:
-        cur.close()
-        conn.close()
+        # Column names once, rows as plain arrays
+        return {"columns": [d[0] for d in cur.description], "rows": rows}
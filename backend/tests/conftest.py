@@ -0,0 +1,60 @@
+import os
+import sys
+
+import pytest
+
+# These tests load real files through COPY, so they need a Postgres:
+#   TEST_DATABASE_URL=postgresql://... python -m pytest
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+# main.py reads its config at import time
+if TEST_DATABASE_URL:
+    os.environ["DATABASE_URL"] = TEST_DATABASE_URL
+    os.environ.setdefault("DATABASE_SSLMODE", "disable")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def main():
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL not set")
+
+    import main
+
+    with main.db() as conn, conn.cursor() as cur:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS dataset_registry (
+                table_name TEXT PRIMARY KEY,
+                dataset_type TEXT NOT NULL,
+                row_count BIGINT,
+                uploaded_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
+        """)
+        conn.commit()
+    return main
+
+
+@pytest.fixture
+def client(main):
+    from fastapi.testclient import TestClient
+
+    with TestClient(main.app) as client:
+        yield client
+
+
+@pytest.fixture
+def upload(client):
+    tables = []
+
+    def upload(filename: str, data: bytes) -> str:
+        response = client.post("/upload-csv", files={"file": (filename, data)})
+        assert response.status_code == 200, response.text
+        tables.append(response.json()["table"])
+        return tables[-1]
+
+    yield upload
+
+    for table in tables:
+        client.post("/datasets/delete", json={"table": table})
+
@@ -0,0 +1,139 @@
+import io
+import struct
+import threading
+
+import pytest
+
+from copyio import (
+    BINARY_HEADER,
+    BINARY_TRAILER,
+    FieldTooLarge,
+    IterReader,
+    stream_copy_out,
+    transcode_chunks,
+    write_binary_row,
+)
+
+# No database needed: a fake cursor stands in for psycopg2's copy_expert
+
+
+class FakeCursor:
+    def __init__(self, rows, error: Exception | None = None):
+        self.rows = rows
+        self.error = error
+        self.sql = None
+
+    def copy_expert(self, sql, file):
+        self.sql = sql
+        for row in self.rows:
+            file.write(row)
+        if self.error:
+            raise self.error
+
+
+class Exits:
+    def __init__(self):
+        self.calls = []
+        self.event = threading.Event()
+
+    def __call__(self, finished: bool):
+        self.calls.append(finished)
+        self.event.set()
+
+    def wait(self) -> list[bool]:
+        assert self.event.wait(5), "on_exit never ran"
+        return self.calls
+
+
+def endless_rows():
+    while True:
+        yield b"S1,School,Name,E1,T\n"
+
+
+def test_stream_copy_out_yields_everything_then_finishes():
+    rows = [b"row %d\n" % i for i in range(1000)]
+    cur, on_exit = FakeCursor(rows), Exits()
+
+    chunks = list(stream_copy_out(cur, "COPY t TO STDOUT", on_exit, chunk_size=100, max_chunks=2))
+
+    assert b"".join(chunks) == b"".join(rows)
+    assert all(len(c) >= 100 for c in chunks[:-1])  # rows coalesced
+    assert cur.sql == "COPY t TO STDOUT"
+    assert on_exit.wait() == [True]
+
+
+def test_stream_copy_out_close_aborts_the_copy():
+    on_exit = Exits()
+    stream = stream_copy_out(FakeCursor(endless_rows()), "COPY t TO STDOUT", on_exit, chunk_size=100, max_chunks=2)
+
+    assert next(stream)
+    stream.close()
+
+    assert on_exit.wait() == [False]
+
+
+def test_stream_copy_out_reraises_copy_errors():
+    on_exit = Exits()
+    cur = FakeCursor([b"row\n"], error=RuntimeError("connection lost"))
+
+    with pytest.raises(RuntimeError, match="connection lost"):
+        list(stream_copy_out(cur, "COPY t TO STDOUT", on_exit))
+    assert on_exit.wait() == [False]
+
+
+def test_iter_reader_serves_reads_across_chunk_boundaries():
+    reader = IterReader([b"abc", b"", b"defgh", b"ij"])
+
+    assert reader.read(2) == b"ab"
+    assert reader.read(4) == b"cdef"
+    assert reader.read(-1) == b"ghij"
+    assert reader.read(4) == b""
+
+
+def test_iter_reader_keeps_the_iterator_error():
+    def chunks():
+        yield b"abc"
+        raise ValueError("bad row")
+
+    reader = IterReader(chunks())
+    assert reader.read(3) == b"abc"
+    with pytest.raises(ValueError):
+        reader.read(3)
+    assert isinstance(reader.error, ValueError)
+
+
+@pytest.mark.parametrize("encoding", ["utf-16", "cp1252", "utf-8-sig"])
+def test_transcode_chunks_handles_characters_split_across_reads(encoding):
+    text = "Ünal,René\r\n€,\xa0x\r\n"
+    data = text.encode(encoding)
+
+    # 3-byte reads split UTF-16 code units and the BOM
+    out = b"".join(transcode_chunks(io.BytesIO(data), encoding, 3))
+
+    assert out == text.encode("utf-8")
+
+
+def test_transcode_chunks_raises_on_a_truncated_file():
+    with pytest.raises(UnicodeDecodeError):
+        list(transcode_chunks(io.BytesIO("abé".encode("utf-8")[:-1]), "utf-8", 2))
+
+
+def test_write_binary_row_frames_text_and_nulls():
+    buf = bytearray()
+    write_binary_row(buf, ["ab", "", "é"], 10)
+
+    assert bytes(buf) == (
+        struct.pack("!h", 3)
+        + struct.pack("!i", 2) + b"ab"
+        + struct.pack("!i", -1)
+        + struct.pack("!i", 2) + "é".encode("utf-8")
+    )
+    assert BINARY_HEADER.startswith(b"PGCOPY\n\xff\r\n\x00")
+    assert BINARY_TRAILER == struct.pack("!h", -1)
+
+
+def test_write_binary_row_limits_encoded_size():
+    # 2 characters but 4 bytes
+    with pytest.raises(FieldTooLarge) as e:
+        write_binary_row(bytearray(), ["ok", "éé"], 3)
+    assert e.value.index == 1
@@ -0,0 +1,30 @@
+import pytest
+
+from diagnostics import DiagnosticError, Stage
+
+
+@pytest.mark.parametrize("table", ["dataset_registry", "unregistered_table"])
+def test_delete_never_drops_an_unregistered_table(main, client, table):
+    with main.db() as conn, conn.cursor() as cur:
+        cur.execute("CREATE TABLE IF NOT EXISTS unregistered_table (id INT)")
+        conn.commit()
+
+    with pytest.raises(DiagnosticError) as e:
+        client.post("/datasets/delete", json={"table": table})
+    assert e.value.stage == Stage.DELETE
+
+    with main.db() as conn, conn.cursor() as cur:
+        cur.execute("SELECT to_regclass(%s)", (table,))
+        assert cur.fetchone()[0] == table
+        cur.execute("DROP TABLE unregistered_table")
+        conn.commit()
+
+
+def test_delete_drops_a_registered_dataset(main, client):
+    data = b"School Code,School Name,Employee Name,Employee Code,Designation\r\nS1,A,B,E1,T\r\n"
+    table = client.post("/upload-csv", files={"file": ("to_delete.csv", data)}).json()["table"]
+
+    assert client.post("/datasets/delete", json={"table": table}).json() == {"status": "deleted"}
+    with main.db() as conn, conn.cursor() as cur:
+        cur.execute("SELECT to_regclass(%s)", (table,))
+        assert cur.fetchone()[0] is None
@@ -0,0 +1,144 @@
+import csv
+import io
+
+import pytest
+
+from diagnostics import DiagnosticError, Stage
+
+HEADER = ["School Code", "School Name", "Employee Name", "Employee Code", "Designation"]
+
+# Every kind of surrounding whitespace the parsers strip, blank cells and
+# quoted separators
+ROWS = {
+    "utf-8": [
+        ["S1", "\xa0Govt School\xa0", "  Asha ", "E1", "Teacher"],
+        ["S1", "\tGovt School\r\n", "　Ravi ", "E2", ""],
+        ["S2", 'Model, "New"\nSchool', " Meena\x85", " E3 ", "   "],
+        ["S2", "", "Ünal", "E4", "\x1fHead "],
+    ],
+    "cp1252": [
+        ["S1", "\xa0Govt School\xa0", "  Asha ", "E1", "Teacher"],
+        ["S2", 'Model, "New"\nSchool', "\tRené\xa0", " E3 ", "   "],
+    ],
+}
+
+
+def build_csv(header: list[str], rows: list[list[str]], encoding: str) -> bytes:
+    out = io.StringIO(newline="")
+    csv.writer(out).writerows([header, *rows])
+    return out.getvalue().encode(encoding)
+
+
+def expected(rows: list[list[str]]) -> list[tuple]:
+    return [tuple(v.strip() or None for v in row) for row in rows]
+
+
+def fetch_rows(main, table: str) -> list[tuple]:
+    with main.db() as conn, conn.cursor() as cur:
+        cur.execute(f'SELECT {", ".join(main.TEACHER_COLUMNS)} FROM "{table}" ORDER BY id')
+        return cur.fetchall()
+
+
+@pytest.mark.parametrize("encoding", ["utf-8", "cp1252"])
+def test_all_load_paths_store_the_same_rows(main, upload, monkeypatch, encoding):
+    rows = ROWS[encoding]
+    passthrough = []
+    copy_passthrough = main.copy_passthrough
+    monkeypatch.setattr(
+        main, "copy_passthrough",
+        lambda *args: passthrough.append(copy_passthrough(*args)) or passthrough[-1],
+    )
+
+    # Header matches the table (reordered) and no cell needs cleaning: raw
+    # bytes go straight to COPY
+    order = [4, 0, 3, 1, 2]
+    reordered = [HEADER[i] for i in order]
+    clean = [[v or "" for v in row] for row in expected(rows)]
+    table = upload(
+        f"passthrough_{encoding}.csv",
+        build_csv(reordered, [[r[i] for i in order] for r in clean], encoding),
+    )
+    assert passthrough == [len(rows)]
+    loaded = {"passthrough": fetch_rows(main, table)}
+
+    # Same header, cells to trim: parsed, never COPYed as-is
+    loaded["untrimmed"] = fetch_rows(
+        main,
+        upload(f"untrimmed_{encoding}.csv", build_csv(reordered, [[r[i] for i in order] for r in rows], encoding)),
+    )
+    assert passthrough == [len(rows)]
+
+    # An extra column forces the parsing paths
+    extra = build_csv(HEADER + ["Remarks"], [r + ["x"] for r in rows], encoding)
+    if main.pacsv is not None:
+        loaded["arrow"] = fetch_rows(main, upload(f"arrow_{encoding}.csv", extra))
+    monkeypatch.setattr(main, "pacsv", None)
+    loaded["python"] = fetch_rows(main, upload(f"python_{encoding}.csv", extra))
+
+    for path, stored in loaded.items():
+        assert stored == expected(rows), path
+
+
+@pytest.mark.parametrize("bad", ["  padded ", '""'])
+def test_passthrough_falls_back_on_cells_past_the_prefix(main, upload, monkeypatch, bad):
+    passthrough = []
+    copy_passthrough = main.copy_passthrough
+    monkeypatch.setattr(
+        main, "copy_passthrough",
+        lambda *args: passthrough.append(copy_passthrough(*args)) or passthrough[-1],
+    )
+
+    rows = [["S1", "School", "Name", f"E{i}", "T"] for i in range(main.SNIFF_BYTES // 20)]
+    data = build_csv(HEADER, rows, "utf-8") + f"S2,School,{bad},E,T\r\n".encode()
+
+    stored = fetch_rows(main, upload("late_trim.csv", data))
+    assert passthrough == [None]
+    assert stored[-1] == ("S2", "School", bad.strip().strip('"') or None, "E", "T")
+
+
+@pytest.mark.parametrize("blank_lines", [False, True])
+@pytest.mark.parametrize("path", ["passthrough", "arrow", "python"])
+def test_oversized_field_reports_first_row(main, client, monkeypatch, path, blank_lines):
+    big = "x" * (main.MAX_FIELD_BYTES + 1)
+    # Rows are CSV records: a multi-line value is still one record
+    rows = [["S1", "o\nk", "A", "E1", "T"], ["S1", big, "B", "E2", "T"], ["S1", "ok", big, "E3", "T"]]
+    header = HEADER
+    if path != "passthrough":
+        header = HEADER + ["Remarks"]
+        rows = [r + ["x"] for r in rows]
+    if path == "arrow" and main.pacsv is None:
+        pytest.skip("pyarrow not installed")
+    if path == "python":
+        monkeypatch.setattr(main, "pacsv", None)
+
+    data = build_csv(header, rows, "utf-8")
+    if blank_lines:
+        # Not records, so not counted by any path
+        first, rest = data.split(b"\r\n", 1)
+        data = first + b"\r\n\r\n\r\n" + rest
+
+    with pytest.raises(DiagnosticError) as e:
+        client.post("/upload-csv", files={"file": (f"big_{path}.csv", data)})
+    assert (e.value.stage, e.value.row, e.value.column) == (Stage.ROW, 3, "school_name")
+
+
+@pytest.mark.parametrize("path", ["arrow", "python"])
+@pytest.mark.parametrize("encoding, bad", [("utf-8", b"\xff\xfe"), ("cp1252", b"\x81")])
+def test_mid_file_decode_error_is_an_encoding_diagnostic(main, client, monkeypatch, path, encoding, bad):
+    if path == "arrow" and main.pacsv is None:
+        pytest.skip("pyarrow not installed")
+    if path == "python":
+        monkeypatch.setattr(main, "pacsv", None)
+    monkeypatch.setattr(main, "detect_encoding", lambda prefix: encoding)
+
+    # Past the sniffed prefix, so only the streaming parse can see it
+    rows = [["S1", "School", "Name", f"E{i}", "T", "x"] for i in range(main.SNIFF_BYTES // 20)]
+    data = build_csv(HEADER + ["Remarks"], rows, encoding) + b"S2," + bad + b",B,E,T,x\r\n"
+
+    with pytest.raises(DiagnosticError) as e:
+        client.post("/upload-csv", files={"file": (f"bad_{path}.csv", data)})
+    assert e.value.stage == Stage.ENCODING
+    if path == "arrow" and encoding == "utf-8":
+        assert e.value.row == len(rows) + 2
+    else:
+        assert e.value.row is None  # decoded ahead of the parser: unknown